@@ -283,19 +283,21 @@ class InkbirdLogger:
             for i in range(len(thermocount)):
                 thermocount[i] = (thermocount[i] + 1 if thermocount[i] < MAXWAIT else 0)
         return True
+
+def temperature(ls, ms):
+    return (((ms ^ 0x80) << 8) + ls - 0x8000 - 320) / 18
+
 def update_temperatures(mac, data):
     if mac is None:
         return
     slot = get_or_assign_slot(mac)
     if slot is None:
         return
-    def t(ls, ms):
-        return (((ms ^ 0x80) << 8) + ls - 0x8000 - 320) / 18
     if len(data) < 12:
         return
     if data[8:12] != [0xFE, 0x7F, 0xFE, 0x7F]:
         return
-    vals = [t(*data[2 * i:2 * i + 2]) for i in range(4)]
+    vals = [temperature(*data[2 * i:2 * i + 2]) for i in range(4)]
     for i, v in enumerate(vals):
         idx = slot + i
         lv = thermostamp[idx]
@@ -26,6 +26,7 @@ import time
 import threading
 import signal
 import os
+from functools import partial
 from dasbus.connection import SystemMessageBus
 from dasbus.loop import EventLoop
 from dasbus.typing import Variant
@@ -66,6 +67,7 @@ allocated_offsets={}
 free_offsets={ 0:0, 4:4, 8:8, 12:12, 16:16, 20:20 }
 inkbirds={}
 gatt_services={}
+device_services={}  # device path -> its temperature service paths
 commands={}
 temperatures={}
 batteries={}
@@ -129,11 +131,12 @@ def reinitialize_inkbird( obj_path ):
 def print_battery( data ):
     print( "battery=",data[0],"%" )
 
+def temperature( lsbyte, msbyte ):
+    value = ((msbyte^0x80)<<8)+lsbyte - 0x8000
+    return (value-320)/18   # Convert to celsius
+
 def update_temperatures( obj_path, data ):
     global stamp
-    def temperature( lsbyte, msbyte ):
-        value = ((msbyte^0x80)<<8)+lsbyte - 0x8000
-        return (value-320)/18   # Convert to celsius
     if data[8:12] != [0xFE,0x7F,0xFE,0x7F]:
         print( "Suspicious temperature packet", data )
         return # Do not process questionable packets.
@@ -191,16 +194,13 @@ def battery_callback( obj_path, obj_iface, obj_dict, invalidated ):
     return True
 
 def bind_notify( proxy, callback, o_path ):
-    proxy.PropertiesChanged.connect(
-        lambda o_iface,o_dict,o_inval:callback(o_path,o_iface,o_dict,o_inval)
-    )
+    proxy.PropertiesChanged.connect( partial( callback, o_path ) )
     proxy.StartNotify()
 
 def gatt_services_cleanup(obj_path):
     """Remove stale GATT state so services can be re-bound on reconnect."""
-    stale = [p for p in gatt_services if p.startswith(obj_path)]
-    for p in stale:
-        del gatt_services[p]
+    for p in device_services.pop(obj_path, ()):
+        gatt_services.pop(p, None)
     bind.pop(obj_path, None)
     commands.pop(obj_path, None)
     temperatures.pop(obj_path, None)
@@ -239,8 +239,9 @@ def services_resolved_callback( obj_path, obj_iface, obj_dict, invalidated ):
         print( "ServicesResolved:", obj_path )
         
         # Rediscover GATT services/chars that belong to this device
+        dev_prefix = obj_path + '/'
         for child_path, child_dict in manager.GetManagedObjects().items():
-            if child_path.startswith(obj_path) and child_path != obj_path:
+            if child_path.startswith(dev_prefix):
                 interface_added_callback(child_path, child_dict)
                 
         # verify bindings
@@ -308,19 +309,20 @@ def interface_added_callback( obj_path, obj_dict ):
         print( "Connecting inkbird device ",obj_path )
         if not obj_path in inkbirds:
             inkbirds[ obj_path ]=new_inkbird
-            new_inkbird.PropertiesChanged.connect( 
-                lambda  a,b,c : services_resolved_callback( obj_path, a,b,c )
+            new_inkbird.PropertiesChanged.connect(
+                partial( services_resolved_callback, obj_path )
             )
         new_inkbird.Connect()
         return True
 
-    parent_path = os.path.dirname(obj_path)
+    parent_path = obj_path.rpartition('/')[0]
     if GATT_SERVICE_IFACE in obj_dict:
         if obj_path in gatt_services: return True
         properties=obj_dict[GATT_SERVICE_IFACE]
         if properties["UUID"].unpack()==TEMPERATURE_UUID:
             if properties["Device"].unpack() in inkbirds:
                 gatt_services[ obj_path ]=False
+                device_services.setdefault( parent_path, [] ).append( obj_path )
                 bind[parent_path]=[]
                 print( "gatt service ", obj_path )
             else:
@@ -332,7 +334,7 @@ def interface_added_callback( obj_path, obj_dict ):
             if gatt_services[parent_path]: return True # Proxies are already bound
             uuid = obj_dict[GATT_CHAR_IFACE]["UUID"].unpack()
             proxy = bus.get_proxy( SERVICE_NAME, obj_path )
-            dev_path = os.path.dirname(parent_path)
+            dev_path = parent_path.rpartition('/')[0]
             if "0000ff01-0000-1000-8000-00805f9b34fb"==uuid:
                 temperatures[dev_path]=proxy
                 bind[dev_path].append((proxy, temperature_callback, dev_path ))
@@ -365,15 +367,14 @@ def logger():
                 laststamp = time.time()
     if (stamp==True):
         t=time.time()
-        sample = enumerate( list(thermostamp) )
+        sample = list(thermostamp)
         stamp,laststamp=False,t
         for i in range( 0,len(thermocount) ):
             n=thermocount[i]
             thermocount[i] = n+1 if n<MAXWAIT else 0
-        print( "%6.2f  "%(t), end="", file=fout )
-        for i,value in sample:
-            print( "% 6.1f "%( value if value<MAXTEMP else float('NaN') ), end="", file=fout )
-        print( "  [°C] ",file=fout )
+        fout.write( "%6.2f  "%(t)
+                    + "".join( "% 6.1f "%( value if value<MAXTEMP else float('NaN') ) for value in sample )
+                    + "  [°C] \n" )
         fout.flush()
     (threading.Timer( 1, logger )).start()
 
@@ -263,13 +263,13 @@ class InkbirdMonitor:
         self.loop.run()
 
 # ---------------- LOGGING ----------------
-def update_temperatures(slot,data):
-    def t(ls,ms): return(((ms^0x80)<<8)+ls-0x8000-320)/18
+def temperature(ls,ms): return(((ms^0x80)<<8)+ls-0x8000-320)/18
 
+def update_temperatures(slot,data):
     if len(data)<12 or data[8:12]!=[0xFE,0x7F,0xFE,0x7F]:
         return
 
-    vals=[t(*data[2*i:2*i+2]) for i in range(4)]
+    vals=[temperature(*data[2*i:2*i+2]) for i in range(4)]
 
     for i,v in enumerate(vals):
         idx=slot+i
@@ -2,15 +2,19 @@ import time
 import threading
 import signal
 import os
+import struct
+import queue
+from array import array
 from enum import Enum
 from dasbus.connection import SystemMessageBus
 from dasbus.loop import EventLoop
+from gi.repository import Gio, GLib
 from dasbus.typing import Variant
-import weakref
 
 # ---------------- Constants ----------------
 MAXTEMP = 1802.5
 WATCHTIME = 45.0
+CONNECT_TIMEOUT = 30.0
 INKBIRD_NAME = 'IDT-34c-B'
 FRIENDLY_NAME = 'INKBIRD'
 ADAPTER_PATH = "/org/bluez/hci0"
@@ -19,32 +23,63 @@ DEVICE_IFACE = "org.bluez.Device1"
 GATT_SERVICE_IFACE = "org.bluez.GattService1"
 GATT_CHAR_IFACE = "org.bluez.GattCharacteristic1"
 TEMPERATURE_UUID = "0000ff00-0000-1000-8000-00805f9b34fb"
+TEMP_CHAR_UUID = "0000ff01-0000-1000-8000-00805f9b34fb"
+CMD_CHAR_UUID = "0000ff02-0000-1000-8000-00805f9b34fb"
+BATTERY_UUID = "00002a19-0000-1000-8000-00805f9b34fb"
 
 MAXWAIT = 20
+FLUSHTIME = 30    # seconds between pushing buffered log lines to disk
+TEMP_FRAME = struct.Struct('<4h')  # offset-binary words; a signed read removes the 0x8000 bias
+SENTINEL = b'\xfe\x7f\xfe\x7f'     # trailer of every valid temperature frame
+EMA_ALPHA = 0.3   # smoothing weight of each accepted sample
+EMA_GATE = 3.0    # reject samples further than this many sigma from the average
+EMA_EPS = 0.25    # variance floor [°C²] so a settled probe still follows small steps
+EMA_GATE_SQ = EMA_GATE*EMA_GATE
+EMA_DECAY = 1 - EMA_ALPHA
 INITIAL_BACKOFF = 2.0
 MAX_BACKOFF = 16.0
 
+# Prebuilt GATT request payloads
+REQUEST_OPTS = {'type': Variant('s', 'request')}
+START_CMD = Variant('ay', bytes([0xfd,0x00,0x00,0x00,0x00,0x00,0x00]))
+INIT_FRAMES = (Variant('ay', bytes([0x02,0x01,0x00,0x00,0x00,0x00,0x00])),
+               Variant('ay', bytes([0x02,0x02,0x00,0x00,0x00,0x00,0x00])),
+               Variant('ay', bytes([0x02,0x04,0x00,0x00,0x00,0x00,0x00])))
+
 # ---------------- Globals ----------------
 bus = SystemMessageBus()
 loop = EventLoop()
 adapter = bus.get_proxy(SERVICE_NAME, ADAPTER_PATH)
 manager = bus.get_proxy(SERVICE_NAME, "/")
 
-fout = open("/tmp/thermal.dat", 'w')
-thermostamp = [float('NaN')] * 24
-thermofilter = [0.] * 24
-thermocount = [0] * 24
+fout = open("/tmp/thermal.dat", 'ab', buffering=1 << 14)
+# Channel state as contiguous typed arrays: one slot per probe, 4 probes per device.
+thermostamp = array('d', [float('NaN')]) * 24
+thermofilter = array('d', [0.]) * 24
+thermovar = array('d', [0.]) * 24
+thermocount = array('i', [0]) * 24
 stamp = False
 laststamp = time.time()
+flush_counter = 0
 
 allocated_offsets = {}
-free_offsets = {0: 0, 4: 4, 8: 8, 12: 12, 16: 16, 20: 20}
+free_mask = 0b111111  # bit n set = probe offsets 4n..4n+3 are free
 
-temperatures = weakref.WeakValueDictionary()
-commands = weakref.WeakValueDictionary()
-batteries = weakref.WeakValueDictionary()
-bind = {}
 gatt_services = {}
+inkbirds = {}
+# Device lifecycle (adopt, connect, pair, teardown) runs on both the GLib loop and the
+# dispatcher thread; this serializes it so neither sees a half-torn-down device.
+lifecycle_lock = threading.RLock()
+
+# PropertiesChanged arrivals waiting for the dispatcher thread
+pending = queue.SimpleQueue()
+
+# ObjectManager mirror, kept current by InterfacesAdded/InterfacesRemoved
+known_paths = set()
+path_ifaces = {}
+
+# Device1 paths exported before their Name; device_props_changed watches for it
+unnamed_devices = set()
 
 # ---------------- Device State Machine ----------------
 class DeviceState(Enum):
@@ -60,19 +95,23 @@ class InkbirdDevice:
         self.obj_path = obj_path
         self.proxy = proxy
         self.state = DeviceState.DISCONNECTED
+        self.state_since = time.time()
         self.lock = threading.Lock()
         self.allocated = False
         self.retry_backoff = INITIAL_BACKOFF
         self.retry_timer = None
+        self.temp_char = self.cmd_char = self.batt_char = None
+        self.uuid_to_char = {}
+        self.bindings = []
 
     # ---------------- State Transitions ----------------
+    # Plain attribute stores/loads are atomic under the GIL; self.lock only guards retry state.
     def transition(self, new_state):
-        with self.lock:
-            self.state = new_state
+        self.state_since = time.time()
+        self.state = new_state
 
     def can_act(self, expected_state):
-        with self.lock:
-            return self.state == expected_state
+        return self.state is expected_state
 
     # ---------------- Retry Scheduling ----------------
     def schedule_retry(self, callback):
@@ -91,38 +130,51 @@ class InkbirdDevice:
                 self.retry_timer = None
             self.retry_backoff = INITIAL_BACKOFF
 
+    # ---------------- Signal Handlers ----------------
+    # Bound methods rather than per-bind lambdas, so teardown can disconnect them.
+    def on_services(self, iface, changed, inval):
+        pending.put((services_resolved_callback, self.obj_path, iface, changed, inval))
+
+    def on_temperature(self, iface, changed, inval):
+        pending.put((temperature_callback, self.obj_path, iface, changed, inval))
+
 # ---------------- Helper Functions ----------------
 def deallocate(obj_path):
-    if obj_path in allocated_offsets:
-        free_offsets[obj_path] = allocated_offsets[obj_path]
-        del allocated_offsets[obj_path]
+    global free_mask
+    offset = allocated_offsets.pop(obj_path, None)
+    if offset is not None:
+        free_mask |= 1 << (offset // 4)
 
 def allocate(obj_path):
-    offset = 1e9
-    best = None
-    if obj_path in free_offsets:
-        best, offset = obj_path, free_offsets[obj_path]
-    else:
-        for key in free_offsets:
-            if offset > free_offsets[key]:
-                best, offset = key, free_offsets[key]
-    allocated_offsets[obj_path] = offset
-    if best in free_offsets:
-        del free_offsets[best]
+    global free_mask
+    if not free_mask:
+        print(f"No free thermometer slot for {obj_path}")
+        return
+    bit = free_mask & -free_mask  # lowest free slot
+    free_mask ^= bit
+    allocated_offsets[obj_path] = (bit.bit_length() - 1) * 4
 
 # ---------------- Teardown ----------------
 def teardown_device(dev_path):
-    if dev_path not in inkbirds:
-        return
-    device = inkbirds[dev_path]
-    device.transition(DeviceState.TEARDOWN)
-    device.cancel_retry()
+    # Claim the device under the lock so a repeated teardown finds nothing to do;
+    # the D-Bus round trips below run unlocked.
+    with lifecycle_lock:
+        device = inkbirds.pop(dev_path, None)
+        if device is None:
+            return
+        device.transition(DeviceState.TEARDOWN)
+        device.cancel_retry()
+        deallocate(dev_path)
+        chars = (device.temp_char, device.cmd_char, device.batt_char)
+        bindings, device.bindings = device.bindings, []
+        device.temp_char = device.cmd_char = device.batt_char = None
+        device.uuid_to_char = {}
 
     print(f"Teardown device: {dev_path}")
-    for char_dict in [temperatures, commands, batteries]:
-        if dev_path in char_dict:
+    for char in chars:
+        if char is not None:
             try:
-                char_dict[dev_path].StopNotify()
+                char.StopNotify()
             except Exception as e:
                 print(f"StopNotify failed: {e}")
     try:
@@ -130,78 +182,131 @@ def teardown_device(dev_path):
     except Exception:
         pass
 
-    for d in [temperatures, commands, batteries]:
-        if dev_path in d:
-            d.pop(dev_path, None)
-    if dev_path in bind:
-        del bind[dev_path]
-    deallocate(dev_path)
+    for proxy, handler in bindings:
+        unbind(proxy, handler)
+    unbind(device.proxy, device.on_services)
     try:
         adapter.RemoveDevice(dev_path)
     except Exception:
         pass
-    del inkbirds[dev_path]
 
 # ---------------- Temperature Handling ----------------
-def temperature(lsbyte, msbyte):
-    value = ((msbyte^0x80)<<8)+lsbyte - 0x8000
-    return (value-320)/18
-
 def update_temperatures(obj_path, data):
     global stamp
-    if len(data) < 12 or data[8:12] != [0xFE,0x7F,0xFE,0x7F]:
+    if len(data) < 12 or data[8:12] != SENTINEL:
+        return
+    offset = allocated_offsets.get(obj_path)
+    if offset is None:
         return
-    t4vec = [temperature(*data[2*i:2*i+2]) for i in range(4)]
-    offset = allocated_offsets[obj_path]
-    for i, value in enumerate(t4vec):
-        vlast = thermostamp[offset+i]
-        redundant = thermocount[offset+i]
-        if redundant and redundant < MAXWAIT and (value == vlast or value == thermofilter[offset+i]):
+    for k, raw in enumerate(TEMP_FRAME.unpack_from(data), offset):
+        value = (raw-320)/18
+        redundant = thermocount[k]
+        if redundant and redundant < MAXWAIT and value == thermofilter[k]:
             continue
-        thermostamp[offset+i] = (value + thermostamp[offset+i])/2. if abs(value-vlast) > 1.5 else value
-        thermofilter[offset+i] = thermostamp[offset+i]
+        thermofilter[k] = value
+        mean = thermostamp[k]
+        if not (mean < MAXTEMP and value < MAXTEMP):
+            # First reading, or a probe plugged in/out: restart the average.
+            thermostamp[k], thermovar[k] = value, 0.
+        else:
+            delta = value - mean
+            sq = delta*delta
+            var = thermovar[k]
+            if sq <= EMA_GATE_SQ*(var + EMA_EPS):
+                thermostamp[k] = mean + EMA_ALPHA*delta
+            thermovar[k] = EMA_DECAY*(var + EMA_ALPHA*sq)
         if not stamp:
-            thermocount[offset+i] = 0
+            thermocount[k] = 0
             stamp = True
 
 def temperature_callback(obj_path, obj_iface, obj_dict, invalidated):
     if "Value" in obj_dict:
-        if obj_path in inkbirds and obj_path not in allocated_offsets:
-            if inkbirds[obj_path].can_act(DeviceState.ACTIVE):
-                allocate(obj_path)
-        update_temperatures(obj_path, obj_dict['Value'].unpack())
+        if obj_path not in allocated_offsets:
+            # free_mask updates are read-modify-write, so allocate under the same
+            # lock teardown holds when it deallocates.
+            with lifecycle_lock:
+                device = inkbirds.get(obj_path)
+                if (device is not None and device.can_act(DeviceState.ACTIVE)
+                        and obj_path not in allocated_offsets):
+                    allocate(obj_path)
+        data = obj_dict['Value'].unpack()
+        update_temperatures(obj_path, data if isinstance(data, bytes) else bytes(data))
 
 # ---------------- Binding ----------------
-def bind_notify(proxy, callback, o_path):
-    proxy.PropertiesChanged.connect(lambda iface, dict, inval: callback(o_path, iface, dict, inval))
+def bind_notify(device, proxy, handler):
+    # Record the handler as soon as it is connected; teardown disconnects exactly these.
+    proxy.PropertiesChanged.connect(handler)
+    device.bindings.append((proxy, handler))
     proxy.StartNotify()
 
+def unbind(proxy, handler):
+    try:
+        proxy.PropertiesChanged.disconnect(handler)
+    except ValueError:
+        pass  # never connected, or already disconnected
+
+def dispatcher():
+    # Drain everything queued since the last pass, merging repeats per (callback, path)
+    # so a notify burst costs one callback run with the newest values.
+    while True:
+        batch = {}
+        item = pending.get()
+        while item is not None:
+            callback, o_path, iface, changed, inval = item
+            merged = batch.get((callback, o_path))
+            if merged is None:
+                batch[(callback, o_path)] = (iface, dict(changed), set(inval))
+            else:
+                merged[1].update(changed)
+                merged[2].update(inval)
+            try:
+                item = pending.get_nowait()
+            except queue.Empty:
+                item = None
+        for (callback, o_path), (iface, changed, inval) in batch.items():
+            try:
+                callback(o_path, iface, changed, list(inval))
+            except Exception as e:
+                print(f"Callback failed on {o_path}: {e}")
+
 # ---------------- Pseudo-pairing ----------------
-def reinitialize_inkbird(obj_path):
-    generic_init = [Variant('ay', [0x02,0x01,0x00,0x00,0x00,0x00,0x00]),
-                    Variant('ay', [0x02,0x02,0x00,0x00,0x00,0x00,0x00]),
-                    Variant('ay', [0x02,0x04,0x00,0x00,0x00,0x00,0x00])]
-    for i in generic_init:
-        commands[obj_path].WriteValue(i, {'type':Variant('s','request')})
+def reinitialize_inkbird(device):
+    for frame in INIT_FRAMES:
+        device.cmd_char.WriteValue(frame, REQUEST_OPTS)
 
 def run_pseudo_pairing(obj_path):
-    device = inkbirds.get(obj_path)
-    if not device or not device.can_act(DeviceState.CONNECTED):
-        return False
+    # The lock only covers claiming the device and the state changes; the GATT
+    # writes run unlocked so the loop never waits on a BLE round trip.
+    with lifecycle_lock:
+        device = inkbirds.get(obj_path)
+        if not device or not device.can_act(DeviceState.CONNECTED):
+            return False
+        device.transition(DeviceState.PSEUDO_PAIRING)
     try:
-        temperatures[obj_path].StartNotify()
-        start_cmd = [0xfd,0x00,0x00,0x00,0x00,0x00,0x00]
-        commands[obj_path].WriteValue(Variant('ay', start_cmd), {'type':Variant('s','request')})
-        reinitialize_inkbird(obj_path)
-        if obj_path in bind:
-            for proxy, cb, path in bind[obj_path]:
-                bind_notify(proxy, cb, path)
-        device.transition(DeviceState.ACTIVE)
-        device.retry_backoff = INITIAL_BACKOFF
-        return True
+        device.temp_char.StartNotify()
+        device.cmd_char.WriteValue(START_CMD, REQUEST_OPTS)
+        reinitialize_inkbird(device)
+        if not device.bindings:
+            bind_notify(device, device.temp_char, device.on_temperature)
+        failed = False
     except Exception as e:
-        device.schedule_retry(lambda: retry_pseudo_pairing(obj_path))
-        return False
+        print(f"Pseudo-pairing failed on {obj_path}: {e}")
+        failed = True
+    with lifecycle_lock:
+        torn_down = inkbirds.get(obj_path) is not device
+        if torn_down:
+            # Drop anything bound after teardown swept the list.
+            stale, device.bindings = device.bindings, []
+        elif failed:
+            device.transition(DeviceState.CONNECTED)
+            device.schedule_retry(lambda: retry_pseudo_pairing(obj_path))
+        elif device.can_act(DeviceState.PSEUDO_PAIRING):
+            device.transition(DeviceState.ACTIVE)
+            device.retry_backoff = INITIAL_BACKOFF
+    if torn_down:
+        for proxy, handler in stale:
+            unbind(proxy, handler)
+    return not (failed or torn_down)
 
 def retry_pseudo_pairing(obj_path):
     device = inkbirds.get(obj_path)
@@ -223,68 +328,149 @@ def services_resolved_callback(obj_path, obj_iface, obj_dict, invalidated):
         teardown_device(obj_path)
 
 # ---------------- Interface Callbacks ----------------
+def connect_device(device):
+    # Connect can take until the D-Bus timeout, so it must not block the loop;
+    # the watchdog tears down anything left in CONNECTING past CONNECT_TIMEOUT.
+    if device.can_act(DeviceState.DISCONNECTED):
+        device.transition(DeviceState.CONNECTING)
+        device.proxy.Connect(callback=connect_done, callback_args=(device,))
+
+def connect_done(call, device):
+    try:
+        call()
+    except Exception as e:
+        print(f"Connect failed on {device.obj_path}: {e}")
+        if device.can_act(DeviceState.CONNECTING):
+            device.transition(DeviceState.DISCONNECTED)
+        return
+    with lifecycle_lock:
+        if inkbirds.get(device.obj_path) is not device:
+            return  # torn down while the call was in flight
+        if device.can_act(DeviceState.CONNECTING):
+            device.transition(DeviceState.CONNECTED)
+    try:
+        device.proxy.Trusted = True
+    except Exception as e:
+        print(f"Setting Trusted failed on {device.obj_path}: {e}")
+
+def cache_characteristic(obj_path, props):
+    # Characteristic paths are <device>/serviceXXXX/charYYYY.
+    device = inkbirds.get(obj_path.rsplit('/', 2)[0])
+    if device is None:
+        return
+    uuid = props['UUID'].unpack()
+    if uuid in device.uuid_to_char:
+        return
+    proxy = bus.get_proxy(SERVICE_NAME, obj_path)
+    device.uuid_to_char[uuid] = proxy
+    if uuid == TEMP_CHAR_UUID:
+        device.temp_char = proxy
+    elif uuid == CMD_CHAR_UUID:
+        device.cmd_char = proxy
+    elif uuid == BATTERY_UUID:
+        device.batt_char = proxy
+
 def interface_added_callback(obj_path, obj_dict):
+    known_paths.add(obj_path)
+    path_ifaces.setdefault(obj_path, set()).update(obj_dict)
+    if GATT_CHAR_IFACE in obj_dict:
+        cache_characteristic(obj_path, obj_dict[GATT_CHAR_IFACE])
+        return
     if DEVICE_IFACE not in obj_dict:
         return
-    name = obj_dict[DEVICE_IFACE].get('Name', Variant('s','')).unpack()
-    if name not in [INKBIRD_NAME, FRIENDLY_NAME]:
+    name = obj_dict[DEVICE_IFACE].get('Name')
+    if name is None:
+        unnamed_devices.add(obj_path)
+        return
+    if name.unpack() not in [INKBIRD_NAME, FRIENDLY_NAME]:
         return
 
-    device = inkbirds.get(obj_path)
-    if device is None:
-        proxy = bus.get_proxy(SERVICE_NAME, obj_path)
-        device = InkbirdDevice(obj_path, proxy)
-        inkbirds[obj_path] = device
-
-    if device.can_act(DeviceState.DISCONNECTED):
-        device.transition(DeviceState.CONNECTING)
-        try:
-            device.proxy.Connect()
-            device.proxy.Trusted = True
-            device.transition(DeviceState.CONNECTED)
-        except Exception:
-            device.transition(DeviceState.DISCONNECTED)
+    with lifecycle_lock:
+        device = inkbirds.get(obj_path)
+        if device is None:
+            proxy = bus.get_proxy(SERVICE_NAME, obj_path)
+            device = InkbirdDevice(obj_path, proxy)
+            inkbirds[obj_path] = device
+            proxy.PropertiesChanged.connect(device.on_services)
+        connect_device(device)
+
+def device_props_changed(connection, sender, obj_path, iface, signal_name, params):
+    # One subscription for every Device1 PropertiesChanged; no rescan covers a late
+    # Name, so this is where nameless devices get their second look.
+    if obj_path not in unnamed_devices:
+        return
+    name = params.unpack()[1].get('Name')
+    if name is None:
+        return
+    unnamed_devices.discard(obj_path)
+    interface_added_callback(obj_path, {DEVICE_IFACE: {'Name': Variant('s', name)}})
 
 def interfaces_removed_callback(path, interfaces):
+    if DEVICE_IFACE in interfaces:
+        unnamed_devices.discard(path)
+    ifaces = path_ifaces.get(path)
+    if ifaces is not None:
+        ifaces.difference_update(interfaces)
+        if not ifaces:
+            del path_ifaces[path]
+            known_paths.discard(path)
     if DEVICE_IFACE in interfaces and path in inkbirds:
         teardown_device(path)
 
 # ---------------- Logger & Scan ----------------
 def logger():
-    global stamp, laststamp
+    global stamp, laststamp, flush_counter
     if not stamp and (time.time()-laststamp) > 120:
         for services in gatt_services:
             if gatt_services[services]:
                 obj_path = os.path.dirname(services)
-                temperatures[obj_path].ReadValue({'type':Variant('s','request')})
+                inkbirds[obj_path].temp_char.ReadValue(REQUEST_OPTS)
                 laststamp = time.time()
     if stamp:
         t = time.time()
-        sample = enumerate(list(thermostamp))
+        sample = thermostamp.tolist()
         stamp, laststamp = False, t
-        for i in range(len(thermocount)):
-            thermocount[i] = min(thermocount[i]+1, MAXWAIT)
-        print(f"{t:6.2f} ", end="", file=fout)
-        for i, value in sample:
-            print(f"{value if value < MAXTEMP else float('NaN'):6.1f} ", end="", file=fout)
-        print("  [°C]", file=fout)
+        thermocount[:] = array('i', [min(n+1, MAXWAIT) for n in thermocount])
+        line = (f"{t:6.2f} "
+                + "".join(f"{value if value < MAXTEMP else float('NaN'):6.1f} " for value in sample)
+                + "  [°C]\n")
+        fout.write(line.encode('utf-8'))
+    flush_counter += 1
+    if flush_counter % FLUSHTIME == 0:
         fout.flush()
-    threading.Timer(1, logger).start()
+        os.fsync(fout.fileno())
+    return True
 
-def scan_dbus():
+def load_managed_objects():
+    # The only full ObjectManager sweep; signals keep known_paths current after this.
+    # Sorted so each device is adopted before cache_characteristic looks for it.
     managed = manager.GetManagedObjects()
-    for obj_path, obj_dict in managed.items():
-        interface_added_callback(obj_path, obj_dict)
-    current_paths = set(managed.keys())
+    for obj_path in sorted(managed):
+        interface_added_callback(obj_path, managed[obj_path])
+
+def watchdog():
+    now = time.time()
     for path in list(inkbirds.keys()):
-        if path not in current_paths:
+        with lifecycle_lock:
+            device = inkbirds.get(path)
+            if device is None:
+                continue
+            stalled = (device.can_act(DeviceState.CONNECTING)
+                       and now - device.state_since > CONNECT_TIMEOUT)
+            gone = path not in known_paths
+            if not (gone or stalled):
+                connect_device(device)  # only issues the async call
+        if gone or stalled:
+            if stalled:
+                print(f"Connect stalled: {path}")
             teardown_device(path)
-    threading.Timer(WATCHTIME, scan_dbus).start()
+    return True
 
 # ---------------- Main ----------------
 def signal_handler(signum, frame):
     for path in list(inkbirds.keys()):
         teardown_device(path)
+    fout.flush()
     if loop is not None:
         loop.quit()
     exit(0)
@@ -294,8 +480,13 @@ try:
     signal.signal(signal.SIGTERM, signal_handler)
     manager.InterfacesAdded.connect(interface_added_callback)
     manager.InterfacesRemoved.connect(interfaces_removed_callback)
-    threading.Timer(1, scan_dbus).start()
-    threading.Timer(1, logger).start()
+    bus.connection.signal_subscribe(SERVICE_NAME, "org.freedesktop.DBus.Properties",
+                                    "PropertiesChanged", None, DEVICE_IFACE,
+                                    Gio.DBusSignalFlags.NONE, device_props_changed)
+    threading.Thread(target=dispatcher, daemon=True).start()
+    load_managed_objects()
+    GLib.timeout_add_seconds(int(WATCHTIME), watchdog)
+    GLib.timeout_add_seconds(1, logger)
     loop.run()
 except Exception as e:
     print(f"Main loop exception: {e}")
@@ -5,6 +5,7 @@ Ultra-minimal diagnostic – focus on callback + logging
 
 import time
 import datetime
+import struct
 from dasbus.connection import SystemMessageBus
 from dasbus.loop import EventLoop
 from dasbus.typing import Variant
@@ -13,12 +14,14 @@ SERVICE_NAME = "org.bluez"
 ADAPTER_PATH = "/org/bluez/hci0"
 DEVICE_IFACE = "org.bluez.Device1"
 GATT_CHAR_IFACE = "org.bluez.GattCharacteristic1"
+TEMP_CHAR_UUID = "0000ff01-0000-1000-8000-00805f9b34fb"
+TEMP_FRAME = struct.Struct("<4h")  # offset-binary probe words; signed read removes the bias
 
 bus = SystemMessageBus()
 loop = EventLoop()
 manager = bus.get_proxy(SERVICE_NAME, "/")
 
-devices = {}  # path -> {'temp_char': proxy}
+devices = {}  # path -> {uuid: characteristic proxy}, filled as BlueZ exports them
 
 fout = open("/tmp/min_diag_thermal.dat", 'a')
 
@@ -36,10 +39,7 @@ def temperature_callback(device_path, iface, changed, invalidated):
         # Try basic parse for 4 temps (no full logic yet)
         if len(data) >= 8:
             try:
-                t1 = round(((data[1] ^ 0x80) << 8 + data[0] - 0x8000 - 320) / 18, 1)
-                t2 = round(((data[3] ^ 0x80) << 8 + data[2] - 0x8000 - 320) / 18, 1)
-                t3 = round(((data[5] ^ 0x80) << 8 + data[4] - 0x8000 - 320) / 18, 1)
-                t4 = round(((data[7] ^ 0x80) << 8 + data[6] - 0x8000 - 320) / 18, 1)
+                t1, t2, t3, t4 = ((raw - 320) / 18 for raw in TEMP_FRAME.unpack_from(bytes(data)))
                 line = f"{time.time():8.2f}   {t1:5.1f}  {t2:5.1f}  {t3:5.1f}  {t4:5.1f}"
                 log(f"QUICK PARSE: {line}")
                 print(line, file=fout)
@@ -49,29 +49,31 @@ def temperature_callback(device_path, iface, changed, invalidated):
     else:
         log(f"Changed keys: {list(changed.keys())}")
 
-def activate_device(device_path):
-    managed = manager.GetManagedObjects()
-    temp_char = None
-
-    for obj_path, interfaces in managed.items():
-        if not obj_path.startswith(device_path + "/"):
-            continue
-        if GATT_CHAR_IFACE not in interfaces:
-            continue
-
-        uuid = interfaces[GATT_CHAR_IFACE]["UUID"].unpack()
-        if uuid == "0000ff01-0000-1000-8000-00805f9b34fb":
-            temp_char = bus.get_proxy(SERVICE_NAME, obj_path)
-            log(f"Found ff01 for {device_path}")
-            temp_char.PropertiesChanged.connect(
-                lambda i, c, inv: temperature_callback(device_path, i, c, inv)
-            )
-            break
+def cache_characteristic(obj_path, interfaces):
+    chars = devices.get(obj_path.rsplit("/", 2)[0])
+    if chars is None or GATT_CHAR_IFACE not in interfaces:
+        return
+    uuid = interfaces[GATT_CHAR_IFACE]["UUID"].unpack()
+    chars[uuid] = bus.get_proxy(SERVICE_NAME, obj_path)
 
+def activate_device(device_path):
+    chars = devices.setdefault(device_path, {})
+    if TEMP_CHAR_UUID not in chars:
+        # Cache miss (e.g. services resolved before we subscribed): fill it once.
+        for obj_path, interfaces in manager.GetManagedObjects().items():
+            if obj_path.startswith(device_path + "/"):
+                cache_characteristic(obj_path, interfaces)
+
+    temp_char = chars.get(TEMP_CHAR_UUID)
     if not temp_char:
         log(f"No ff01 found for {device_path}")
         return
 
+    log(f"Found ff01 for {device_path}")
+    temp_char.PropertiesChanged.connect(
+        lambda i, c, inv: temperature_callback(device_path, i, c, inv)
+    )
+
     try:
         temp_char.StartNotify()
         log(f"ff01 notifications ENABLED for {device_path}")
@@ -79,15 +81,20 @@ def activate_device(device_path):
         log(f"StartNotify failed {device_path}: {e}")
 
 def on_properties_changed(path, iface, changed, invalidated):
-    if "ServicesResolved" in changed and changed["ServicesResolved"].unpack():
-        log(f"Services resolved: {path}")
-        activate_device(path)
+    if "ServicesResolved" in changed:
+        if changed["ServicesResolved"].unpack():
+            log(f"Services resolved: {path}")
+            activate_device(path)
+        else:
+            devices.get(path, {}).clear()  # GATT objects go away with the link
 
 def on_interfaces_added(path, interfaces):
+    cache_characteristic(path, interfaces)
     if DEVICE_IFACE in interfaces:
         name = interfaces[DEVICE_IFACE].get("Name", Variant("s", "")).unpack()
         if name in ['IDT-34c-B', 'INKBIRD']:
             log(f"Found Inkbird: {path}")
+            devices.setdefault(path, {})
             proxy = bus.get_proxy(SERVICE_NAME, path)
             proxy.PropertiesChanged.connect(
                 lambda i, c, inv: on_properties_changed(path, i, c, inv)
@@ -23,14 +23,17 @@
 # Scan
 
 import time
-import threading
 import signal
 import os
+import struct
+import collections
+from functools import partial
 from dasbus.connection import SystemMessageBus
 from dasbus.loop import EventLoop
+from gi.repository import GLib
 from dasbus.typing import Variant
 from dasbus.signal import Signal
-import weakref
+from dasbus.client.proxy import disconnect_proxy
 
 # Characteristic properties bitmask
 # [Extended][Auth_Sign][Indicate][Notify]  [Write][Write-NoResp][Read][Broadcast]
@@ -47,6 +50,7 @@ ADAPTER_IFACE="org.bluez.Adapter1"
 GATT_SERVICE_IFACE="org.bluez.GattService1"
 GATT_CHAR_IFACE="org.bluez.GattCharacteristic1"
 GATT_DESC_IFACE="org.bluez.GattDescriptor1"
+WANTED_IFACES=frozenset(( DEVICE_IFACE, GATT_SERVICE_IFACE, GATT_CHAR_IFACE ))
 
 TEMPERATURE_UUID="0000ff00-0000-1000-8000-00805f9b34fb"
 
@@ -56,48 +60,85 @@ adapter = bus.get_proxy( SERVICE_NAME, ADAPTER_PATH )
 manager = bus.get_proxy( SERVICE_NAME, "/" ) 
 
 MAXWAIT=20 # Maximum stamping before termperature is not considered redundant. 
-fout = open( "/tmp/thermal.dat", 'w' )
-thermostamp=[ float('NaN') ]*24
+FLUSHTIME=30 # Seconds between pushing buffered log lines to disk.
+TEMP_FRAME=struct.Struct('<4h') # Four offset-binary probe words; a signed read removes the 0x8000 bias.
+SENTINEL=b'\xfe\x7f\xfe\x7f'   # Trailer of every valid temperature packet.
+REQUEST_OPTS={ 'type':Variant('s','request') }
+START_CMD=Variant( 'ay', [0xfd,0x00,0x00,0x00,0x00,0x00,0x00] )
+GENERIC_INIT=( # Pseudo-pairing writes, built once at import.
+    Variant( 'ay', [0x02,0x01,0x00,0x00,0x00,0x00,0x00] ),  # self +0x0000
+    Variant( 'ay', [0x02,0x02,0x00,0x00,0x00,0x00,0x00] ),  # self +0x0000
+    Variant( 'ay', [0x02,0x04,0x00,0x00,0x00,0x00,0x00] ),  # self +0x0000
+    Variant( 'ay', [0x02,0x08,0x00,0x00,0x00,0x00,0x00] ),  # self +0x0000
+
+    Variant( 'ay', [0x04,0x00,0x00,0x00,0x00,0x00,0x00] ),  # 0x0446
+    Variant( 'ay', [0x06,0x00,0x00,0x00,0x00,0x00,0x00] ),  # 0x0663
+    Variant( 'ay', [0x08] ),                                # 0x080f00
+    Variant( 'ay', [0x0a,0x0f,0x00,0x00,0x00,0x00,0x00] ),  # self +0x0000
+    Variant( 'ay', [0x0c,0x00,0x00,0x00,0x00,0x00,0x00] ),  # 0x0c5a
+
+    Variant( 'ay', [0x0f,0x00,0x00,0x00,0x00,0x00,0x00] ),  # *Hash returned,varies.
+    Variant( 'ay', [0x11,0x00,0x00,0x00,0x00,0x00,0x00] ),  # 0x111100
+    Variant( 'ay', [0x13,0x00,0x00,0x00,0x00,0x00,0x00] ),  # 0x13fe
+    Variant( 'ay', [0x18]),                                 # self +0x000000000000
+    Variant( 'ay', [0x24]),                                 # self +0x0f0000000000000000 *droppable
+    Variant( 'ay', [0x26,0x01]),                            # self +0x0h000000000000000   *droppable
+    Variant( 'ay', [0x26,0x02]),                            # self +0x0000000000000000   *droppable
+    Variant( 'ay', [0x26,0x04]),                            # self +0x0000000000000000   *droppable
+    Variant( 'ay', [0x26,0x08]),                            # self +0x0000000000000000
+)
+
+fout = open( "/tmp/thermal.dat", 'w', buffering=65536 )
+NAN=float('NaN')
+thermostamp=[ NAN ]*24
 thermofilter=[ 0. ]*24
 thermocount=[ 0 ]*24  # How many times has temperature already been stamped to the log file.  (Redundancy limiter).
+LOG_LINE="%6.2f  " + "% 6.1f "*len(thermostamp) + "  [°C] \n"  # One format pass per log line.
 stamp = False
 laststamp = time.time()
+flush_counter = 0
 
 allocated_offsets={}
-free_offsets={ 0:0, 4:4, 8:8, 12:12, 16:16, 20:20 }
-inkbirds=weakref.WeakValueDictionary()
+free_offsets=collections.deque([ 0, 4, 8, 12, 16, 20 ])
+inkbirds={}
 gatt_services={}
-commands=weakref.WeakValueDictionary()
-temperatures=weakref.WeakValueDictionary()
-batteries=weakref.WeakValueDictionary()
-bind={}
+service_device={}    # temperature service path -> device path
+device_services={}   # device path -> its temperature service paths
+active_services=set() # services whose notify callbacks are bound
+managed_paths=set()   # object paths seen by the previous scan_dbus
+device_paths=set()    # scanned device paths, retried until they become inkbirds
 last_temp=[]
 
+class InkbirdDevice:
+    """Proxies for one thermometer; inkbirds maps its device path to this."""
+    __slots__=( 'proxy', 'temperature', 'command', 'battery', 'binds' )
+    def __init__( self, proxy ):
+        self.proxy=proxy
+        self.temperature=None  # ff01 notify characteristic
+        self.command=None      # ff02 command characteristic
+        self.battery=None
+        self.binds=[]          # (proxy, callback, path) hooked up after pseudo-pairing
+
 def signal_handler( signum, frame ):
     print("Signal received, tearing down all devices")
     for path in list(inkbirds.keys()):
         teardown_device(path)
+    fout.flush()
     if loop is not None:
         loop.quit()
     exit(0)
 
 def deallocate(obj_path):
-    if obj_path in allocated_offsets:
-       free_offsets[ obj_path ] = allocated_offsets[ obj_path ] 
-       del allocated_offsets[ obj_path ]
+    offset = allocated_offsets.pop( obj_path, None )
+    if offset is not None:
+        # Reused first, so a device that drops and reconnects keeps its log columns.
+        free_offsets.appendleft( offset )
    
 def allocate(obj_path):
-    offset = 1e9 
-    best = None
-    if obj_path in free_offsets:
-        best,offset = obj_path, free_offsets[ obj_path ]
-    else:
-        for key in free_offsets:
-            if offset > free_offsets[key]:
-                best,offset = key,free_offsets[key]
-    allocated_offsets[obj_path] = offset
-    if best in free_offsets:
-        del free_offsets[best]
+    if not free_offsets:
+        print("No free thermometer offset for", obj_path)
+        return
+    allocated_offsets[obj_path] = free_offsets.popleft()
     
 def teardown_device(dev_path):
     """Force clean disconnect, reference drop, and BlueZ cache flush.
@@ -105,27 +146,27 @@ def teardown_device(dev_path):
     """
     print(f"Teardown device: {dev_path}")
     
-    # Stop Notifications
-    for char_dict in [temperatures, commands, batteries]:
-        if dev_path in char_dict:
-            try:
-                char_dict[dev_path].StopNotify()
-            except Exception as e:
-                print(f"StopNotify failed on {dev_path}: {e}")
-                
-    # Disconnect
-    if dev_path in inkbirds:
+    device = inkbirds.pop(dev_path, None)
+    if device is not None:
+        # Stop Notifications
+        for char in (device.temperature, device.command, device.battery):
+            if char is not None:
+                try:
+                    char.StopNotify()
+                except Exception as e:
+                    print(f"StopNotify failed on {dev_path}: {e}")
+
+        # Disconnect
         try:
-            inkbirds[dev_path].Disconnect()
+            device.proxy.Disconnect()
         except Exception as e:
             print(f"Disconnect failed on {dev_path}: {e}")
-    # Clean up
-    for d in [inkbirds, temperatures, commands, batteries]:
-        if dev_path in d:
-            d.pop(dev_path, None)
-            
-    if dev_path in bind:
-        del bind[dev_path]
+
+    # Forget GATT services so they are rediscovered and rebound on reconnect
+    for svc in device_services.pop(dev_path, ()):
+        service_device.pop(svc, None)
+        gatt_services.pop(svc, None)
+        active_services.discard(svc)
         
     # Free offset
     deallocate(dev_path)
@@ -136,76 +177,75 @@ def teardown_device(dev_path):
     except Exception as e:
         print(f"RemoveDevice failed (probably already gone): {e}")
 
-def reinitialize_inkbird( obj_path ):
-    generic_init=[ 
-        Variant( 'ay', [0x02,0x01,0x00,0x00,0x00,0x00,0x00] ),  # self +0x0000
-        Variant( 'ay', [0x02,0x02,0x00,0x00,0x00,0x00,0x00] ),  # self +0x0000
-        Variant( 'ay', [0x02,0x04,0x00,0x00,0x00,0x00,0x00] ),  # self +0x0000
-        Variant( 'ay', [0x02,0x08,0x00,0x00,0x00,0x00,0x00] ),  # self +0x0000
-
-        Variant( 'ay', [0x04,0x00,0x00,0x00,0x00,0x00,0x00] ),  # 0x0446
-        Variant( 'ay', [0x06,0x00,0x00,0x00,0x00,0x00,0x00] ),  # 0x0663
-        Variant( 'ay', [0x08] ),                                # 0x080f00
-        Variant( 'ay', [0x0a,0x0f,0x00,0x00,0x00,0x00,0x00] ),  # self +0x0000
-        Variant( 'ay', [0x0c,0x00,0x00,0x00,0x00,0x00,0x00] ),  # 0x0c5a
-
-        Variant( 'ay', [0x0f,0x00,0x00,0x00,0x00,0x00,0x00] ),  # *Hash returned,varies.
-        Variant( 'ay', [0x11,0x00,0x00,0x00,0x00,0x00,0x00] ),  # 0x111100
-        Variant( 'ay', [0x13,0x00,0x00,0x00,0x00,0x00,0x00] ),  # 0x13fe
-        Variant( 'ay', [0x18]),                                 # self +0x000000000000
-        Variant( 'ay', [0x24]),                                 # self +0x0f0000000000000000 *droppable
-        Variant( 'ay', [0x26,0x01]),                            # self +0x0h000000000000000   *droppable
-        Variant( 'ay', [0x26,0x02]),                            # self +0x0000000000000000   *droppable
-        Variant( 'ay', [0x26,0x04]),                            # self +0x0000000000000000   *droppable
-        Variant( 'ay', [0x26,0x08]),                            # self +0x0000000000000000
-    ]
+def reinitialize_inkbird( obj_path, on_done ):
+    """Send the init writes in order, each one from the reply to the previous,
+    so the loop is never blocked; on_done(obj_path) runs after the last reply.
+    A failed write abandons the handshake and schedules a pairing retry.
+    """
     print("re-initializing ",obj_path )
-    for i in generic_init:
-        commands[ obj_path ].WriteValue( i, { 'type':Variant('s','request') } )
+    write_init_frame( obj_path, 0, on_done )
+
+def write_init_frame( obj_path, index, on_done ):
+    device = inkbirds.get(obj_path)
+    if device is None or device.command is None:
+        return  # torn down between writes
+    device.command.WriteValue( GENERIC_INIT[index], REQUEST_OPTS,
+                               callback=init_write_done, callback_args=(obj_path, index, on_done) )
+
+def init_write_done( call, obj_path, index, on_done ):
+    try:
+        call()
+    except Exception as e:
+        print(f"Init write {index} failed on {obj_path}: {e}")
+        GLib.timeout_add_seconds(4, retry_pseudo_pairing, obj_path)
+        return
+    index += 1
+    if index < len(GENERIC_INIT):
+        write_init_frame( obj_path, index, on_done )
+    else:
+        on_done( obj_path )
 
 def print_battery( data ):
     print( "battery=",data[0],"%" )
 
 def update_temperatures( obj_path, data ):
     global stamp
-    def temperature( lsbyte, msbyte ):
-        value = ((msbyte^0x80)<<8)+lsbyte - 0x8000
-        return (value-320)/18   # Convert to celsius
-    if len(data) < 12 or data[8:12] != [0xFE,0x7F,0xFE,0x7F]:
+    if len(data) < 12 or data[8:12] != SENTINEL:
         print( "Suspicious temperature packet", data )
         return # Do not process questionable packets.
-    t4vec = [ temperature( *data[2*i:2*i+2] ) for i in range(0,4) ]
+    t4vec = [ (raw-320)/18 for raw in TEMP_FRAME.unpack_from( data ) ]  # Convert to celsius
     print(f"Parsed temperatures for {obj_path}: {t4vec}") 
     offset = allocated_offsets[ obj_path ]
-    for i,value in enumerate( t4vec ):
-        vlast = thermostamp[offset+i]
-        redundant = thermocount[offset+i]
+    for k,value in enumerate( t4vec, offset ):
+        vlast = thermostamp[k]
+        redundant = thermocount[k]
         if ( redundant and (redundant<MAXWAIT) and
-            (value == vlast or value==thermofilter[offset+i]) ): 
+            (value == vlast or value==thermofilter[k]) ): 
             continue
         if abs( value-vlast )>1.5 :
-            if (value>MAXTEMP) or thermostamp[offset+i]>MAXTEMP:
-                thermostamp[ offset+i ] = value 
+            if (value>MAXTEMP) or vlast>MAXTEMP:
+                thermostamp[ k ] = value 
             else:
-                thermostamp[ offset+i ] = (value+thermostamp[offset+i])/2.
-            thermofilter[ offset+i ] = thermostamp[ offset+i ]
+                thermostamp[ k ] = (value+vlast)/2.
+            thermofilter[ k ] = thermostamp[ k ]
             continue
-        thermofilter[offset+i]=thermostamp[offset+i]
-        thermostamp[offset+i]=value
+        thermofilter[k]=vlast
+        thermostamp[k]=value
         if not stamp:
-            thermocount[offset+i]=0
+            thermocount[k]=0
             stamp = True
 
 def temperature_callback( obj_path, obj_iface, obj_dict, invalidated ):
     if "Value" in obj_dict:
-        if obj_path in inkbirds and obj_path not in allocated_offsets:
-            if inkbirds[obj_path].Connected:
+        device = inkbirds.get(obj_path)
+        if device is not None and obj_path not in allocated_offsets:
+            if device.proxy.Connected:
                 allocate(obj_path)
-                inkbirds[obj_path].Trusted = True
+                device.proxy.Trusted = True
                 print("Allocated offset on late notify for", obj_path)
             else:
                 print("Temperature notify for disconnected inkbird:", obj_path, allocated_offsets)
-        update_temperatures( obj_path, obj_dict['Value'].unpack() )
+        update_temperatures( obj_path, bytes( obj_dict['Value'].unpack() ) )
 
 def command_callback( obj_path, obj_iface, obj_dict, invalidated ):
     print( "Command notify\t\t", obj_path, invalidated )
@@ -227,16 +267,22 @@ def battery_callback( obj_path, obj_iface, obj_dict, invalidated ):
         print_battery( obj_dict['Value'].unpack() )
     return True
 
+# Characteristic UUID -> (InkbirdDevice attribute, notify callback).
+CHAR_ROLES={
+    "0000ff01-0000-1000-8000-00805f9b34fb": ( 'temperature', temperature_callback ),
+    "0000ff02-0000-1000-8000-00805f9b34fb": ( 'command', command_callback ),
+    "00002a19-0000-1000-8000-00805f9b34fb": ( 'battery', battery_callback ),
+}
+
 def bind_notify( proxy, callback, o_path ):
-    proxy.PropertiesChanged.connect(
-        lambda o_iface,o_dict,o_inval:callback(o_path,o_iface,o_dict,o_inval)
-    )
+    proxy.PropertiesChanged.connect( partial( callback, o_path ) )
     proxy.StartNotify()
 
 def retry_bind(obj_path):
-    if obj_path in bind and bind[obj_path]:
+    device = inkbirds.get(obj_path)
+    if device is not None and device.binds:
         try:
-            for n, i in enumerate(bind[obj_path]):
+            for n, i in enumerate(device.binds):
                 bind_notify(*i)
             print(f"Retry bind successful for {obj_path}")
         except Exception as e:
@@ -245,42 +291,63 @@ def retry_bind(obj_path):
         print(f"Retry bind: still no entries for {obj_path}")
 
 def run_pseudo_pairing(obj_path):
-    if obj_path not in commands:
+    """Start pairing; the remaining steps run as GLib timeouts so the loop is never blocked."""
+    device = inkbirds.get(obj_path)
+    if device is None or device.command is None:
         print(f"Cannot run pseudo-pairing yet: ff02 missing on {obj_path}")
         return False
 
     print(f"Running pseudo-pairing for {obj_path}")
 
-    if obj_path in temperatures:
+    if device.temperature is not None:
         try:
-            temperatures[obj_path].StartNotify()
+            device.temperature.StartNotify()
             print(f"ff01 notifications ENABLED early on {obj_path}")
-            time.sleep(0.4)  # let subscription settle
         except Exception as e:
             print(f"ff01 StartNotify failed: {e}")
             return False
 
+    GLib.timeout_add(400, send_start_command, obj_path)  # let subscription settle
+    return True
+
+def send_start_command(obj_path):
+    device = inkbirds.get(obj_path)
+    if device is None or device.command is None:
+        return False  # torn down while waiting
     try:
-        start_cmd = [0xfd, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
-        commands[obj_path].WriteValue(Variant('ay', start_cmd), {'type': Variant('s', 'request')})
-        print(f"START sent: {bytes(start_cmd).hex()} on {obj_path}")
-        time.sleep(0.5)  # give firmware time to start streaming
+        device.command.WriteValue(START_CMD, REQUEST_OPTS)
+        print(f"START sent: {bytes(START_CMD.unpack()).hex()} on {obj_path}")
     except Exception as e:
         print(f"START failed: {e}")
+        GLib.timeout_add_seconds(4, retry_pseudo_pairing, obj_path)
+        return False
+    GLib.timeout_add(500, finish_pseudo_pairing, obj_path)  # give firmware time to start streaming
+    return False
+
+def finish_pseudo_pairing(obj_path):
+    device = inkbirds.get(obj_path)
+    if device is None or device.command is None:
         return False
+    reinitialize_inkbird(obj_path, bind_callbacks)
+    return False
 
-    reinitialize_inkbird(obj_path)
+def bind_callbacks(obj_path):
+    device = inkbirds.get(obj_path)
+    if device is None:
+        return  # torn down while the init writes were in flight
 
-    if obj_path in bind and bind[obj_path]:
+    if device.binds:
         try:
-            for proxy, cb, path in bind[obj_path]:
+            for proxy, cb, path in device.binds:
                 bind_notify(proxy, cb, path)
+            for svc in device_services.get(obj_path, ()):
+                gatt_services[svc]=True
+                active_services.add(svc)
             print("Callbacks bound")
         except Exception as e:
             print(f"Binding failed: {e}")
 
     print("Pseudo Pairing completed")
-    return True
 
 
 def services_resolved_callback(obj_path, obj_iface, obj_dict, invalidated):
@@ -299,37 +366,66 @@ def services_resolved_callback(obj_path, obj_iface, obj_dict, invalidated):
         return True
     else:
         print("ff02 not ready — scheduling retry")
-        threading.Timer(3.0, lambda: retry_pseudo_pairing(obj_path)).start()
+        GLib.timeout_add_seconds(3, retry_pseudo_pairing, obj_path)
         return True
 
 def retry_pseudo_pairing(obj_path):
+    """GLib timeout: returning True keeps retrying, False stops."""
+    if obj_path not in inkbirds:
+        return False
     if run_pseudo_pairing(obj_path):
         print(f"Retry succeeded for {obj_path}")
-    else:
-        print(f"Still waiting for ff02 on {obj_path}")
-        threading.Timer(4.0, lambda: retry_pseudo_pairing(obj_path)).start()
+        return False
+    print(f"Still waiting for ff02 on {obj_path}")
+    return True
+
+def connect_done( call, obj_path ):
+    try:
+        call()
+    except Exception as e:
+        print(f"Connect failed on {obj_path}: {e}")
+        # Forget it locally but keep the BlueZ object, so scan_dbus can retry it.
+        device = inkbirds.pop(obj_path, None)
+        if device is not None:
+            disconnect_proxy(device.proxy)
+        deallocate(obj_path)
+        return
+    device = inkbirds.get(obj_path)
+    if device is None:
+        return  # torn down while connecting
+    device.proxy.Trusted = True
+    print("Trusted set early for", obj_path)
+    # Give BlueZ time to export the GATT tree without holding up the loop.
+    GLib.timeout_add_seconds( 5, scan_device_children, obj_path )
+
+def scan_device_children( obj_path ):
+    if obj_path in inkbirds:
+        managed = manager.GetManagedObjects()
+        dev_prefix = obj_path + '/'
+        for p in sorted(managed):
+            if p.startswith(dev_prefix):
+                interface_added_callback(p, managed[p])
+    return False
 
 def interface_added_callback( obj_path, obj_dict ):
-    if DEVICE_IFACE in obj_dict:
-        try:
-            properties = obj_dict[DEVICE_IFACE]
-            name = properties.get('Name').unpack()
-            if ( name!=INKBIRD_NAME and name!=FRIENDLY_NAME ): return False
-        except:
+    matched = WANTED_IFACES.intersection( obj_dict )
+    if not matched: return False
+    if DEVICE_IFACE in matched:
+        name = obj_dict[DEVICE_IFACE].get('Name')
+        if name is None:
             print("Ignoring unstable interface in memory")
             return True
+        name = name.unpack()
+        if ( name!=INKBIRD_NAME and name!=FRIENDLY_NAME ): return False
         print("inkbird ",obj_path)
-        try:
-            new_inkbird=inkbirds[obj_path]
-        except:
-            if len(free_offsets)==0:
-                print("Inkbird script has insufficient thermometer memory")
-                return False
-            new_inkbird=bus.get_proxy(SERVICE_NAME, obj_path)
-            print("new-inkbird proxy")
-        else:
-                print(" Already known")
-                return True # All good connections exit from here.
+        if obj_path in inkbirds:
+            print(" Already known")
+            return True # All good connections exit from here.
+        if len(free_offsets)==0:
+            print("Inkbird script has insufficient thermometer memory")
+            return False
+        new_inkbird=bus.get_proxy(SERVICE_NAME, obj_path)
+        print("new-inkbird proxy")
         # Either the connection is new or it is corrupted.
         if new_inkbird.Connected:
             print( "Corrupted connection state:",obj_path, name )
@@ -342,24 +438,16 @@ def interface_added_callback( obj_path, obj_dict ):
             return False  # Something's wrong, see if time resolves it.
         # new device connection. 
         print( "Connecting inkbird device ",obj_path )
-        if not obj_path in inkbirds:
-            inkbirds[ obj_path ]=new_inkbird
-            new_inkbird.PropertiesChanged.connect( 
-                lambda  a,b,c : services_resolved_callback( obj_path, a,b,c )
-            )
-        new_inkbird.Connect()
-        new_inkbird.Trusted = True
-        print("Trusted set early for", obj_path)
-        time.sleep(5)
-        managed = manager.GetManagedObjects()
-        for p, d in managed.items():
-            if p.startswith(obj_path):
-                interface_added_callback(p, d)
+        inkbirds[ obj_path ]=InkbirdDevice( new_inkbird )
+        new_inkbird.PropertiesChanged.connect(
+            partial( services_resolved_callback, obj_path )
+        )
+        new_inkbird.Connect( callback=connect_done, callback_args=(obj_path,) )
         return True
         
 
-    parent_path = os.path.dirname(obj_path)
-    if GATT_SERVICE_IFACE in obj_dict:
+    parent_path = obj_path.rpartition('/')[0]
+    if GATT_SERVICE_IFACE in matched:
         if obj_path in gatt_services: return True
         properties=obj_dict[GATT_SERVICE_IFACE]
         
@@ -370,35 +458,34 @@ def interface_added_callback( obj_path, obj_dict ):
         if properties["UUID"].unpack()==TEMPERATURE_UUID:
             if properties["Device"].unpack() in inkbirds:
                 gatt_services[ obj_path ]=False
-                bind[parent_path]=[]
+                service_device[ obj_path ]=parent_path
+                device_services.setdefault( parent_path, [] ).append( obj_path )
+                inkbirds[ parent_path ].binds=[]
                 print( "gatt service ", obj_path )
             else:
                 print(" Error",properties['Device'].unpack())
         return True
 
-    if GATT_CHAR_IFACE in obj_dict:
+    if GATT_CHAR_IFACE in matched:
         if parent_path in gatt_services:
             if gatt_services[parent_path]: return True # Proxies are already bound
             uuid = obj_dict[GATT_CHAR_IFACE]["UUID"].unpack()
             print(f"Discovered characteristic UUID: {uuid} at path {obj_path} for device")
-            proxy = bus.get_proxy( SERVICE_NAME, obj_path )
-            dev_path = os.path.dirname(parent_path)
-            if "0000ff01-0000-1000-8000-00805f9b34fb"==uuid:
-                temperatures[dev_path]=proxy
-                bind[dev_path].append((proxy, temperature_callback, dev_path ))
-                return
-            if "0000ff02-0000-1000-8000-00805f9b34fb"==uuid:
-                commands[dev_path]=proxy
-                bind[dev_path].append((proxy, command_callback, dev_path ))
+            dev_path = parent_path.rpartition('/')[0]
+            device = inkbirds.get(dev_path)
+            if device is None: return True
+            role = CHAR_ROLES.get(uuid)
+            if role is not None:
+                attr, callback = role
+                proxy = bus.get_proxy( SERVICE_NAME, obj_path )
+                setattr( device, attr, proxy )
+                device.binds.append((proxy, callback, dev_path ))
                 return
             if uuid.startswith("0000ff"):
                 if uuid.startswith("0000ff05"):
                     return
-                bind[dev_path].append((proxy, extra_callback, dev_path ))
-                return
-            if uuid=="00002a19-0000-1000-8000-00805f9b34fb":
-                batteries[dev_path]=proxy
-                bind[dev_path].append((proxy, battery_callback, dev_path ))
+                proxy = bus.get_proxy( SERVICE_NAME, obj_path )
+                device.binds.append((proxy, extra_callback, dev_path ))
                 return
         return True
     return False
@@ -408,46 +495,55 @@ def interfaces_removed_callback(path, interfaces):
         print(f"BlueZ removed device object: {path}")
         teardown_device(path)
 
+def unstall_read_done( call, obj_path ):
+    try:
+        call()
+    except Exception as e:
+        print(f"Unstall read failed on {obj_path}: {e}")
+
 def logger():
-    global stamp,laststamp
+    global stamp,laststamp,flush_counter
     if (stamp==False and (time.time()-laststamp)>120):
         print("logger stalled (no valid data yet), attempting to clear...")
-        for services in gatt_services:
-            if gatt_services[services] is True:
-                obj_path = os.path.dirname( services ) 
-                print("Unstalling ",obj_path)
-                temperatures[ obj_path ].ReadValue({ 'type':Variant('s','request') })
-                laststamp = time.time()
+        for services in active_services:
+            obj_path = service_device[ services ]
+            print("Unstalling ",obj_path)
+            try:
+                inkbirds[ obj_path ].temperature.ReadValue( REQUEST_OPTS,
+                    callback=unstall_read_done, callback_args=(obj_path,) )
+            except Exception as e:
+                print(f"Unstall read failed on {obj_path}: {e}")
+            laststamp = time.time()
     if (stamp==True):
         t=time.time()
-        sample = enumerate( list(thermostamp) )
         stamp,laststamp=False,t
-        for i in range( 0,len(thermocount) ):
-            n=thermocount[i]
-            thermocount[i] = n+1 if n<MAXWAIT else 0
-        print( "%6.2f  "%(t), end="", file=fout )
-        for i,value in sample:
-            print( "% 6.1f "%( value if value<MAXTEMP else float('NaN') ), end="", file=fout )
-        print( "  [°C] ",file=fout )
+        thermocount[:] = [ n+1 if n<MAXWAIT else 0 for n in thermocount ]
+        fout.write( LOG_LINE%( t, *( value if value<MAXTEMP else NAN for value in thermostamp ) ) )
+    flush_counter += 1
+    if flush_counter % FLUSHTIME == 0:
         fout.flush()
-    (threading.Timer( 1, logger )).start()
+        os.fsync( fout.fileno() )
+    return True
 
 def scan_dbus():
+    global managed_paths
     print("Scan dbus")
     managed = manager.GetManagedObjects()
-    for obj_path, obj_dict in managed.items():
-        interface_added_callback(obj_path, obj_dict)
-        
+    current_paths = set(managed)
+    new_paths = current_paths - managed_paths
+    device_paths.intersection_update(current_paths)
+    device_paths.update( p for p in new_paths if DEVICE_IFACE in managed[p] )
+    # Only new objects, plus devices not yet adopted (name may arrive late,
+    # or the last connect failed).  Sorting visits a device before its children.
+    for obj_path in sorted( new_paths | (device_paths - inkbirds.keys()) ):
+        interface_added_callback(obj_path, managed[obj_path])
+    managed_paths = current_paths
+
     # Clean up any known devices removed without InterfacesRemoved
-    current_paths = set(managed.keys())
-    for path in list(inkbirds.keys()):
-        if path not in current_paths:
-            print(f"Proactive cleanup: {path} missing from managed objects")
-            teardown_device(path)
-            
-    # Timer starts
-    (threading.Timer(WATCHTIME, scan_dbus)).start()
-    return
+    for path in inkbirds.keys() - current_paths:
+        print(f"Proactive cleanup: {path} missing from managed objects")
+        teardown_device(path)
+    return True
 #
 # ------------------- Main logic proceedure begins here --------------------------
 #
@@ -457,8 +553,9 @@ try:
     signal.signal(signal.SIGTERM, signal_handler )
     manager.InterfacesAdded.connect( interface_added_callback )
     manager.InterfacesRemoved.connect( interfaces_removed_callback )
-    (threading.Timer( 1, scan_dbus )).start()
-    (threading.Timer( 1, logger )).start()
+    scan_dbus()
+    GLib.timeout_add_seconds( int(WATCHTIME), scan_dbus )
+    GLib.timeout_add_seconds( 1, logger )
     loop.run()
 except Exception as e:
     print(f"Main loop exception {e}")